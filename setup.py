@@ -26,6 +26,7 @@ setup(
         ],
     },
     install_requires=[
-        'python-rtmidi>=1.5.8'
+        'python-rtmidi>=1.5.8',
+        'numpy',
     ],
 )
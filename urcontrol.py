@@ -3,10 +3,15 @@
 import sys
 import os
 import argparse
+import functools
+import mmap
+import re
+import struct
 import threading
 import time
 
 
+import numpy as np
 import rtmidi
 
 class UR44C():
@@ -15,19 +20,42 @@ class UR44C():
         "F043103E14010100pppp0000ccvvvvvvvvvvF7" - Change Parameter
         "F043303E1401040200pppp0000ccF7" - Query Parameter
         "F043103E1401040200pppp0000ccvvvvvvvvvvF7 - Reply Parameter
+        "F043303E140203327FF7" - Query Meter Status
         "F043103E140203........" - Reply Meter Status
     '''
 
+    METER_CHANNELS = 48
 
-    def __init__(self, midi_in, midi_out):
-        self.midi_in = midi_in
-        self.midi_in.ignore_types(sysex=False)
-        self.midi_in.set_callback(self._midi_callback, self)
-        time.sleep(0.1)
 
-        self.midi_out = midi_out
+    def __init__(self, midi_in, midi_out):
         self.received_params = {}
         self.received_param_event = threading.Event()
+        self.meter_history = None
+        # last known (channel, param) -> value, restored after reconnect
+        self.state = {}
+        self.connected = threading.Event()
+        # port_lock: swapping/closing ports and sending
+        # query_lock: request/reply exchanges (received_params, received_param_event, state resync)
+        self.port_lock = threading.RLock()
+        self.query_lock = threading.Lock()
+        self._attach_ports(midi_in, midi_out)
+
+    def _attach_ports(self, midi_in, midi_out):
+        with self.port_lock:
+            self.midi_in = midi_in
+            self.midi_in.ignore_types(sysex=False)
+            self.midi_in.set_callback(self._midi_callback, self)
+            time.sleep(0.1)
+
+            self.midi_out = midi_out
+            self.connected.set()
+
+    def _send(self, message):
+        with self.port_lock:
+            if not self.connected.is_set():
+                return False
+            self.midi_out.send_message(message)
+            return True
 
     @classmethod
     def _sysex_parser(cls, message):
@@ -65,6 +93,17 @@ class UR44C():
                 'param': param,
                 'value': value,
             }
+        #meter status message: 48 meters, 4 bytes each (current hi/lo, peak hi/lo)
+        elif len(message)>=8+cls.METER_CHANNELS*4 and message[:7]==[0xF0, 0x43, 0x10, 0x3E, 0x14, 0x02, 0x03]:
+            values = []
+            for i in range(7, 7+cls.METER_CHANNELS*4, 2):
+                v0 = message[i] - 128 if message[i] > 64 else message[i]
+                values.append(v0*128 + message[i+1])
+            return {
+                'type': 'meters',
+                'current': values[0::2],
+                'peak': values[1::2],
+            }
         #keepalive
         elif message==[0xF0, 0x43, 0x10, 0x3E, 0x14, 0x00, 0x04, 0x02, 0xF7]:
             return {'type': 'keepalive'}
@@ -76,8 +115,13 @@ class UR44C():
         message, timestamp = event
         res = self._sysex_parser(message)
         if res['type']=='reply-parameter':
+            # not written to state: replies to resync queries may arrive after the restore
             obj.received_params[(res['channel'], res['param'])] = res['value']
             obj.received_param_event.set()
+        elif res['type']=='change-parameter':
+            obj.state[(res['channel'], res['param'])] = res['value']
+        elif res['type']=='meters' and obj.meter_history is not None:
+            obj.meter_history.Record(res['current'], res['peak'])
 
 
     def MIDISendChangeParameterValue(self, parameter, value, channel=0):
@@ -90,46 +134,64 @@ class UR44C():
         v3 = (v32 >> 7*3) & 0x7F
         v4 = (v32 >> 7*4) & 0x7F
         message = [0xF0, 0x43, 0x10, 0x3E, 0x14, 0x01, 0x01, 0x00, p1, p0, 0x00, 0x00, channel, v4, v3, v2, v1, v0, 0xF7]
-        self.midi_out.send_message(message)
+        return self._send(message)
 
 
     def MIDISendQueryParameterValue(self, parameter, channel=0):
         p0 = (parameter >> 7*0) & 0x7F
         p1 = (parameter >> 7*1) & 0x7F
         message = [0xF0, 0x43, 0x30, 0x3E, 0x14, 0x01, 0x04, 0x02, 0x00, p1, p0, 0x00, 0x00, channel, 0xF7]
-        self.midi_out.send_message(message)
+        return self._send(message)
+
+
+    def MIDISendQueryMeters(self):
+        message = [0xF0, 0x43, 0x30, 0x3E, 0x14, 0x02, 0x03, 0x32, 0x7F, 0xF7]
+        return self._send(message)
 
 
     def SendKeepalive(self):
         message = [0xF0, 0x43, 0x10, 0x3E, 0x14, 0x00, 0x04, 0x02, 0xF7]
-        self.midi_out.send_message(message)
+        return self._send(message)
 
 
     def SetParameter(self, parameter, value, channel=0, confirm=True, confirm_timeout=3):
-        self.MIDISendChangeParameterValue(parameter, value, channel)
-        if confirm:
-            self.received_params.pop((channel, parameter), None)
-            self.received_param_event.clear()
-            self.MIDISendQueryParameterValue(parameter, channel)
-            if self.received_param_event.wait(confirm_timeout):
-                received_value = self.received_params.pop((channel, parameter), None)
-                self.received_param_event.clear()
-                if received_value == value:
-                    return True
+        # wait outside the lock: reconnect holds it until state is resynced
+        if not self.connected.wait(confirm_timeout):
             return False
-        else:
-            return True
+        with self.query_lock:
+            if not self.MIDISendChangeParameterValue(parameter, value, channel):
+                return False
+            if confirm:
+                self.received_params.pop((channel, parameter), None)
+                self.received_param_event.clear()
+                self.MIDISendQueryParameterValue(parameter, channel)
+                if self.received_param_event.wait(confirm_timeout):
+                    received_value = self.received_params.pop((channel, parameter), None)
+                    self.received_param_event.clear()
+                    if received_value == value:
+                        self.state[(channel, parameter)] = value
+                        return True
+                return False
+            else:
+                self.state[(channel, parameter)] = value
+                return True
 
     def GetParameter(self, parameter, channel=0, check_timeout=3):
-        self.received_params.pop((channel, parameter), None)
-        self.received_param_event.clear()
-        self.MIDISendQueryParameterValue(parameter, channel)
-
-        if self.received_param_event.wait(check_timeout):
-            received_value = self.received_params.pop((channel, parameter), None)
+        if not self.connected.wait(check_timeout):
+            return None
+        with self.query_lock:
+            self.received_params.pop((channel, parameter), None)
             self.received_param_event.clear()
-            return received_value
-        return None
+            if not self.MIDISendQueryParameterValue(parameter, channel):
+                return None
+
+            if self.received_param_event.wait(check_timeout):
+                received_value = self.received_params.pop((channel, parameter), None)
+                self.received_param_event.clear()
+                if received_value is not None:
+                    self.state[(channel, parameter)] = received_value
+                return received_value
+            return None
 
     def SetParameterByName(self, unit, name, value, input=0):
         param_num, min_val, max_val, def_val, val_descr, notes = getattr(unit, name)
@@ -143,6 +205,50 @@ class UR44C():
         return self.GetParameter(param_num, input)
 
 
+    def Disconnect(self):
+        with self.port_lock:
+            self.connected.clear()
+            self.midi_in.cancel_callback()
+            self.midi_in.close_port()
+            self.midi_out.close_port()
+
+    def Reconnect(self, midi_in, midi_out, resync_timeout=0.5):
+        # no other request may run between reopening ports and resync
+        with self.query_lock:
+            with self.port_lock:
+                if self.connected.is_set():
+                    self.Disconnect()
+                self._attach_ports(midi_in, midi_out)
+            return self._resync_state(resync_timeout)
+
+    def ResyncState(self, timeout=0.5):
+        with self.query_lock:
+            return self._resync_state(timeout)
+
+    def _resync_state(self, timeout):
+        # query all known parameters at once and send only those that differ
+        state = dict(self.state)
+        for key in state:
+            self.received_params.pop(key, None)
+        self.received_param_event.clear()
+        for channel, parameter in state:
+            self.MIDISendQueryParameterValue(parameter, channel)
+
+        deadline = time.monotonic() + timeout
+        while not all(key in self.received_params for key in state):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.received_param_event.wait(remaining):
+                break
+            self.received_param_event.clear()
+
+        changed = 0
+        for (channel, parameter), value in state.items():
+            if self.received_params.pop((channel, parameter), None) != value:
+                if self.MIDISendChangeParameterValue(parameter, value, channel):
+                    changed += 1
+        return changed
+
+
     def ResetConfig(self):
         message = bytes.fromhex(initialize_bulk_message)
         # self.midi_out.send_message(message)
@@ -529,47 +635,709 @@ class UR44C_Params_MBComp:
     MHxover             = (343,   17,   108,    93,    "17:42.5Hz; 93:3.35kHz; 108:8.00kHz", None)
 
 
+units = {
+    'mixer':    UR44C_Params_Mixer,
+    'chstrip':  UR44C_Params_ChStrip,
+    'clean':    UR44C_Params_Clean,
+    'crunch':   UR44C_Params_Crunch,
+    'lead':     UR44C_Params_Lead,
+    'drive':    UR44C_Params_Drive,
+    'pitchfix': UR44C_Params_PitchFix,
+    'hall':     UR44C_Params_Hall,
+    'room':     UR44C_Params_Room,
+    'plate':    UR44C_Params_Plate,
+    'delay':    UR44C_Params_Delay,
+    'ducker':   UR44C_Params_Ducker,
+    'mbcomp':   UR44C_Params_MBComp,
+}
+
+
+
+class UR44C_ParameterUnits:
+    '''
+        Conversion between raw parameter values and physical units (dB, Hz, ms),
+        built from anchor points of the "Values explain" column, e.g. "0:-∞; 1:-74dB; 103:0dB; 127:+6dB".
+        Values between anchors are interpolated linearly for dB; for Hz and ms logarithmically
+        when the anchors fit a logarithmic scale better than a linear one.
+        Conversion tables are built once per parameter (see get_parameter_units).
+        All methods accept scalars or arrays.
+    '''
+
+    # unit in description -> (base unit, scale)
+    UNITS = {'db': ('dB', 1), 'hz': ('Hz', 1), 'khz': ('Hz', 1000), 'ms': ('ms', 1), 's': ('ms', 1000)}
+    ANCHOR_RE = re.compile(r'^\s*(-?\d+)\s*:\s*([+-]?(?:\d+(?:\.\d*)?|∞|inf))\s*([a-zA-Z]*)\s*$')
+    VALUE_RE = re.compile(r'^\s*([+-]?(?:\d+(?:\.\d*)?|\.\d+|∞|inf))\s*([a-zA-Z]*)\s*$')
+
+    def __init__(self, min_val, max_val, unit, raw, values):
+        self.min_val = min_val
+        self.max_val = max_val
+        self.unit = unit
+
+        order = np.argsort(raw)
+        raw = np.asarray(raw, dtype=np.float64)[order]
+        values = np.asarray(values, dtype=np.float64)[order]
+        finite = np.isfinite(values)
+        self.log = unit != 'dB' and self._log_scale(unit, raw[finite], values[finite])
+        domain = np.log(values[finite]) if self.log else values[finite]
+
+        raw_range = np.arange(min_val, max_val+1)
+        self.domain = np.interp(raw_range, raw[finite], domain)
+        for r, v in zip(raw[~finite], values[~finite]):
+            if min_val <= r <= max_val:
+                self.domain[int(r) - min_val] = v
+        self.table = np.exp(self.domain) if self.log else self.domain
+
+        # sorted domain for inverse lookups
+        self.order = np.argsort(self.domain, kind='stable')
+        self.sorted_domain = self.domain[self.order]
+
+    @staticmethod
+    def _log_scale(unit, raw, values):
+        if values.min() <= 0:
+            return False
+        if len(values) < 3:
+            # two points can't tell, frequency controls are logarithmic
+            return unit == 'Hz'
+        linear = np.polyval(np.polyfit(raw, values, 1), raw)
+        log = np.exp(np.polyval(np.polyfit(raw, np.log(values), 1), raw))
+        return np.abs(log/values - 1).max() < np.abs(linear/values - 1).max()
+
+    @classmethod
+    def FromDescription(cls, min_val, max_val, description):
+        unit = None
+        raw = []
+        values = []
+        for item in description.split(';'):
+            m = cls.ANCHOR_RE.match(item)
+            if not m:
+                continue
+            if m.group(2) in ('∞', 'inf', '+∞', '+inf', '-∞', '-inf'):
+                value = float('-inf') if m.group(2).startswith('-') else float('inf')
+            else:
+                value = float(m.group(2))
+            if m.group(3):
+                if m.group(3).lower() not in cls.UNITS:
+                    return None
+                base, scale = cls.UNITS[m.group(3).lower()]
+                if unit not in (None, base):
+                    return None
+                unit = base
+                value *= scale
+            elif np.isfinite(value):
+                continue
+            raw.append(int(m.group(1)))
+            values.append(value)
+
+        if unit is None or np.isfinite(values).sum() < 2:
+            return None
+        return cls(min_val, max_val, unit, raw, values)
+
+    def ToPhysical(self, raw):
+        '''
+            Physical values for raw values (rounded to integers), nan for raw values out of range
+        '''
+        index = np.rint(raw).astype(np.intp) - self.min_val
+        values = np.take(self.table, index, mode='clip')
+        values = np.where((index < 0) | (index >= len(self.table)), np.nan, values)
+        return float(values) if np.ndim(raw) == 0 else values
+
+    def FromPhysical(self, values):
+        '''
+            Nearest raw values for physical values; values out of range (and values <= 0 on log scale)
+            map to the edge raw values. Raises ValueError for nan.
+        '''
+        scalar = np.ndim(values) == 0
+        values = np.asarray(values, dtype=np.float64)
+        if np.isnan(values).any():
+            raise ValueError('Cannot convert nan to raw value')
+        if self.log:
+            with np.errstate(divide='ignore'):
+                domain = np.where(values > 0, np.log(np.maximum(values, 0)), -np.inf)
+        else:
+            domain = values
+        i = np.clip(np.searchsorted(self.sorted_domain, domain), 1, len(self.sorted_domain)-1)
+        left = self.sorted_domain[i-1]
+        right = self.sorted_domain[i]
+        with np.errstate(invalid='ignore'):
+            nearest = np.where((domain <= left) | (domain - left <= right - domain), i-1, i)
+        raw = self.order[nearest] + self.min_val
+        return int(raw) if scalar else raw
+
+    def Parse(self, text):
+        '''
+            Raw value for text like "-6dB", "1kHz", "250ms", "1.5s", "-inf".
+            The unit is required except for ±inf; bare numbers are raw values and rejected here.
+            Raises ValueError for values outside of the parameter range.
+        '''
+        text = text.strip()
+        m = self.VALUE_RE.match(text)
+        if not m:
+            raise ValueError(f'Cannot parse value {text}')
+        number, unit = m.groups()
+        if number.lstrip('+-') in ('∞', 'inf'):
+            value = float('-inf') if number.startswith('-') else float('inf')
+        else:
+            value = float(number)
+            if not unit:
+                raise ValueError(f'{text}: physical value needs a unit ({self.unit})')
+        if unit:
+            base, scale = self.UNITS.get(unit.lower(), (None, 1))
+            if base != self.unit:
+                raise ValueError(f'Unit {unit} does not match parameter unit {self.unit}')
+            value *= scale
+
+        if self.unit != 'dB' and value <= 0:
+            raise ValueError(f'{text}: value must be positive')
+        # allowed: finite range of the table (with rounding tolerance) or the -∞ anchor
+        finite = np.flatnonzero(np.isfinite(self.table))
+        low = finite[np.argmin(self.table[finite])]
+        high = finite[np.argmax(self.table[finite])]
+        tolerance = 1e-9 * max(abs(self.table[low]), abs(self.table[high]))
+        if not (self.table[low] - tolerance <= value <= self.table[high] + tolerance or value in self.table):
+            raise ValueError(f'{text}: out of range {self.Format(low + self.min_val)} .. {self.Format(high + self.min_val)}')
+        return self.FromPhysical(value)
+
+    def Format(self, raw):
+        value = self.ToPhysical(raw)
+        if np.isnan(value):
+            return 'out of range'
+        if not np.isfinite(value):
+            return '-∞' if value < 0 else '∞'
+        if self.unit == 'dB':
+            return f'{value:+.1f}dB'
+        if value >= 999.5:
+            return f'{value/1000:.3g}{"kHz" if self.unit == "Hz" else "s"}'
+        return f'{value:.3g}{self.unit}'
+
+
+@functools.lru_cache(maxsize=None)
+def _parameter_units(min_val, max_val, description):
+    return UR44C_ParameterUnits.FromDescription(min_val, max_val, description)
+
+
+def get_parameter_units(param):
+    '''
+        Cached UR44C_ParameterUnits for parameter tuple, None if its values have no physical unit
+    '''
+    param_num, min_val, max_val, def_val, val_descr, notes = param
+    return _parameter_units(min_val, max_val, val_descr)
+
+
+
+class _MeterStore:
+    '''
+        Memory-mapped file of fixed-size records with a 64-byte header:
+        magic, number of records, resolution (0 for raw frames) and number of channels
+    '''
+    MAGIC = b'URMETER1'
+    HEADER_SIZE = 64
+    HEADER_DTYPE = np.dtype([('magic', 'S8'), ('count', '<u8'), ('resolution', '<f8'), ('channels', '<u4')])
+    GROW_RECORDS = 65536
+
+    def __init__(self, path, dtype, resolution, channels, readonly=False):
+        self.path = path
+        self.dtype = dtype
+        self.resolution = resolution
+        self.readonly = readonly
+
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            with open(path, 'wb') as f:
+                f.truncate(self.HEADER_SIZE)
+            self.header = np.memmap(path, dtype=self.HEADER_DTYPE, mode='r+', shape=(1,))
+            self.header[0] = (self.MAGIC, 0, resolution, channels)
+        else:
+            self.header = np.memmap(path, dtype=self.HEADER_DTYPE, mode='r' if readonly else 'r+', shape=(1,))
+            if self.header[0]['magic'] != self.MAGIC:
+                raise Exception(f'{path} is not a meter history file')
+            if self.header[0]['resolution'] != resolution or self.header[0]['channels'] != channels:
+                raise Exception(f'{path} has incompatible resolution or number of channels')
+
+        self.count = int(self.header[0]['count'])
+        self.data = None
+        self._map(self.count if readonly else self.count + self.GROW_RECORDS)
+
+    def _map(self, capacity):
+        if self.data is not None:
+            if not self.readonly:
+                self.data.flush()
+            self.data = None
+        if not self.readonly:
+            size = self.HEADER_SIZE + capacity*self.dtype.itemsize
+            if os.path.getsize(self.path) != size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(size)
+        self.capacity = capacity
+        if capacity:
+            self.data = np.memmap(self.path, dtype=self.dtype, mode='r' if self.readonly else 'r+',
+                                  offset=self.HEADER_SIZE, shape=(capacity,))
+
+    def Append(self, record):
+        if self.count == self.capacity:
+            self._map(self.capacity + self.GROW_RECORDS)
+        self.data[self.count] = record
+        self.count += 1
+        self.header[0]['count'] = self.count
+
+    def ReplaceLast(self, record):
+        self.data[self.count-1] = record
+
+    def Records(self):
+        # another process may still be recording into the file
+        if self.readonly and int(self.header[0]['count']) > self.count:
+            self.count = int(self.header[0]['count'])
+            self._map(self.count)
+        if not self.count:
+            return np.empty(0, dtype=self.dtype)
+        return self.data[:self.count]
+
+    def Close(self):
+        if not self.readonly:
+            self._map(self.count)
+            self.header.flush()
+        self.data = None
+        self.header = None
+
+
+class UR44C_MeterHistory:
+    '''
+        Persistent meter history for post-show review and clipping audits.
+
+        <path>        - raw frames:                       time, current[48], peak[48]
+        <path>.<N>s   - rollups per N seconds of frames:  time, min[48], max[48], peak[48]
+
+        min/max are taken from current values, peak is the maximum of peak values.
+        Rollup time is the start of its bucket; the unfinished bucket is written on Close().
+        When a file is reopened for appending, the last rollup bucket is continued in place.
+        Timestamps are kept non-decreasing: a timestamp earlier than the last recorded one
+        (e.g. wall clock stepped back) is clamped to it.
+    '''
+
+    def __init__(self, path, resolutions=(1, 10, 60), readonly=False, channels=UR44C.METER_CHANNELS):
+        self.channels = channels
+        self.readonly = readonly
+        self.lock = threading.Lock()
+
+        raw_dtype = np.dtype([('time', '<f8'), ('current', '<i2', (channels,)), ('peak', '<i2', (channels,))])
+        rollup_dtype = np.dtype([('time', '<f8'), ('min', '<i2', (channels,)), ('max', '<i2', (channels,)), ('peak', '<i2', (channels,))])
+
+        self.levels = [_MeterStore(path, raw_dtype, 0, channels, readonly)]
+        for resolution in sorted(resolutions):
+            rollup_path = f'{path}.{resolution:g}s'
+            if readonly and not os.path.exists(rollup_path):
+                continue
+            self.levels.append(_MeterStore(rollup_path, rollup_dtype, resolution, channels, readonly))
+
+        # per rollup level: [bucket, min, max, peak, stored] of the bucket being accumulated,
+        # stored - the bucket is already the last record of the file (written by previous Close())
+        self.pending = [None] * len(self.levels)
+        if not readonly:
+            for i in range(1, len(self.levels)):
+                records = self.levels[i].Records()
+                if len(records):
+                    last = records[-1]
+                    bucket = int(round(float(last['time']) / self.levels[i].resolution))
+                    self.pending[i] = [bucket, last['min'].copy(), last['max'].copy(), last['peak'].copy(), True]
+        self.closed = False
+        records = self.levels[0].Records()
+        self.last_time = float(records[-1]['time']) if len(records) else float('-inf')
+
+    @property
+    def resolutions(self):
+        return [level.resolution for level in self.levels]
+
+    def Record(self, current, peak, timestamp=None):
+        t = time.time() if timestamp is None else timestamp
+        current = np.asarray(current, dtype=np.int16)
+        peak = np.asarray(peak, dtype=np.int16)
+        with self.lock:
+            if self.closed or self.readonly:
+                return
+            t = max(t, self.last_time)
+            self.last_time = t
+            self.levels[0].Append((t, current, peak))
+            for i in range(1, len(self.levels)):
+                bucket = int(t // self.levels[i].resolution)
+                acc = self.pending[i]
+                if acc is not None and acc[0] == bucket:
+                    np.minimum(acc[1], current, out=acc[1])
+                    np.maximum(acc[2], current, out=acc[2])
+                    np.maximum(acc[3], peak, out=acc[3])
+                else:
+                    self._flush_pending(i)
+                    self.pending[i] = [bucket, current.copy(), current.copy(), peak.copy(), False]
+
+    def _flush_pending(self, i):
+        acc = self.pending[i]
+        if acc is not None:
+            record = (acc[0]*self.levels[i].resolution, acc[1], acc[2], acc[3])
+            if acc[4]:
+                self.levels[i].ReplaceLast(record)
+            else:
+                self.levels[i].Append(record)
+            self.pending[i] = None
+
+    def Query(self, start=None, end=None, resolution=0):
+        '''
+            Return records with time in [start, end) as a NumPy structured array.
+            Uses the coarsest stored level not coarser than `resolution` (0 - raw frames).
+        '''
+        with self.lock:
+            level = self.levels[0]
+            for candidate in self.levels:
+                if candidate.resolution <= resolution:
+                    level = candidate
+            records = level.Records()
+            times = records['time']
+            if start is None:
+                i0 = 0
+            elif level.resolution:
+                # include the bucket which contains start
+                i0 = int(np.searchsorted(times, start - level.resolution, side='right'))
+            else:
+                i0 = int(np.searchsorted(times, start, side='left'))
+            i1 = len(records) if end is None else int(np.searchsorted(times, end, side='left'))
+            return np.array(records[i0:max(i0, i1)])
+
+    def Close(self):
+        with self.lock:
+            if self.closed:
+                return
+            if not self.readonly:
+                for i in range(1, len(self.levels)):
+                    self._flush_pending(i)
+            for level in self.levels:
+                level.Close()
+            self.closed = True
+
+
+
+
+def midi_port_base_name(name):
+    # ALSA port names end with "client:port", the client number changes when the device is replugged
+    return re.sub(r'\s+\d+:\d+$', '', name)
+
+
+def find_midi_port(ports, name='', ignore_client=False):
+    if name and ignore_client:
+        base = midi_port_base_name(name)
+        for i, v in enumerate(ports):
+            if midi_port_base_name(v) == base:
+                return i
+        return -1
+    if name:
+        return ports.index(name) if name in ports else -1
+    index = -1
+    for i, v in enumerate(ports):
+        if 'Steinberg UR' in v:
+            index = i
+    return index
 
 
 def open_midi_ports(args):
     midi_in = rtmidi.MidiIn()
-    if args.midi_in:
-        try:
-            index = midi_in.get_ports().index(args.midi_in)
-        except ValueError:
+    index = find_midi_port(midi_in.get_ports(), args.midi_in)
+    if index == -1:
+        if args.midi_in:
             print(f'Cannot find input midi port {args.midi_in}')
-            sys.exit(1)
-    else:
-        index = -1
-        for i, v in enumerate(midi_in.get_ports()):
-            if 'Steinberg UR' in v:
-                index = i
-        if index == -1:
+        else:
             print(f'Cannot find Steinberg UR device')
-            sys.exit(1)
+        sys.exit(1)
     midi_in.open_port(index)
     midi_in.ignore_types(sysex=False)
 
     midi_out = rtmidi.MidiOut()
-    if args.midi_out:
-        try:
-            index = midi_out.get_ports().index(args.midi_out)
-        except ValueError:
+    index = find_midi_port(midi_out.get_ports(), args.midi_out)
+    if index == -1:
+        if args.midi_out:
             print(f'Cannot find input midi port {args.midi_out}')
-            sys.exit(1)
-    else:
-        index = -1
-        for i, v in enumerate(midi_out.get_ports()):
-            if 'Steinberg UR' in v:
-                index = i
-        if index == -1:
+        else:
             print(f'Cannot find Steinberg UR device')
-            sys.exit(1)
+        sys.exit(1)
     midi_out.open_port(index)
 
     return midi_in, midi_out
 
 
+class UR44C_PortWatcher:
+    '''
+        Polls the rtmidi port list in background thread. When the opened input port is missing
+        from the list (unplug, USB bus reset longer than the poll interval), UR44C is disconnected;
+        when the device is listed again, ports are reopened and state is resynced.
+        The port usually comes back under the same name; explicit port names are matched
+        without the trailing "client:port" suffix in case the client number differs.
+    '''
+
+    def __init__(self, ur44c, midi_in_name='', midi_out_name='', interval=0.1, verbose=False):
+        self.ur44c = ur44c
+        self.midi_in_name = midi_in_name
+        self.midi_out_name = midi_out_name
+        self.interval = interval
+        self.verbose = verbose
+        self.probe_in = rtmidi.MidiIn()
+
+        ports = self.probe_in.get_ports()
+        index = find_midi_port(ports, midi_in_name)
+        self.port_name = ports[index] if index != -1 else None
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def Start(self):
+        self.thread.start()
+
+    def Stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self._poll()
+            except Exception as e:
+                # keep watching, retry on next poll
+                print(f'Port watcher error: {e!r}', file=sys.stderr)
+
+    def _poll(self):
+        if self.ur44c.connected.is_set():
+            if self.port_name not in self.probe_in.get_ports():
+                self.ur44c.Disconnect()
+                if self.verbose:
+                    print(f'Device disconnected: {self.port_name}')
+            return
+
+        # enumerate and open on the same objects, so indexes can't shift in between
+        midi_in = rtmidi.MidiIn()
+        in_ports = midi_in.get_ports()
+        in_index = find_midi_port(in_ports, self.midi_in_name, ignore_client=True)
+        if in_index == -1:
+            return
+        midi_out = rtmidi.MidiOut()
+        out_index = find_midi_port(midi_out.get_ports(), self.midi_out_name, ignore_client=True)
+        if out_index == -1:
+            return
+        try:
+            midi_in.open_port(in_index)
+            midi_out.open_port(out_index)
+        except rtmidi.RtMidiError:
+            # port list changed again, try on next poll
+            midi_in.close_port()
+            midi_out.close_port()
+            return
+        try:
+            changed = self.ur44c.Reconnect(midi_in, midi_out)
+        except Exception:
+            if not self.ur44c.connected.is_set():
+                midi_in.close_port()
+                midi_out.close_port()
+            raise
+        self.port_name = in_ports[in_index]
+        if self.verbose:
+            print(f'Device reconnected: {self.port_name}, {changed} parameters restored')
+
+
+class UR44C_CaptureAnalyzer:
+    '''
+        Offline analyzer of usbmon captures (pcap or pcapng, as saved by Wireshark/tshark).
+
+        The file is read through mmap in one pass, USB-MIDI event packets are reassembled
+        into SysEx messages and decoded by UR44C._sysex_parser. Collected:
+          timelines       - (channel, param) -> [(time, direction, value), ...], only when value changes
+          message_counts  - message type -> count
+          unknown         - first 8 bytes (hex) -> [count, min len, max len, first time, last time]
+    '''
+
+    LINKTYPE_USB_LINUX = 189
+    LINKTYPE_USB_LINUX_MMAPPED = 220
+    USBMON_HEADER = 'QBBBBHbbqiiII'
+    # magic -> (endianness, timestamp fraction scale)
+    PCAP_MAGIC = {
+        b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+        b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+        b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+        b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+    }
+    PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+    MAX_SYSEX = 65536
+
+    def __init__(self, path):
+        self.path = path
+        self.start_time = None
+        self.timelines = {}
+        self.message_counts = {}
+        self.unknown = {}
+        # link types of all capture interfaces
+        self.linktypes = set()
+
+    def _pcap_packets(self, mm):
+        if len(mm) < 24:
+            raise ValueError(f'{self.path}: truncated pcap header')
+        endian, scale = self.PCAP_MAGIC[mm[:4]]
+        linktype = struct.unpack_from(endian+'I', mm, 20)[0] & 0x0FFFFFFF
+        self.linktypes.add(linktype)
+
+        record = struct.Struct(endian+'IIII')
+        pos = 24
+        while pos + record.size <= len(mm):
+            sec, frac, caplen, _ = record.unpack_from(mm, pos)
+            pos += record.size
+            yield sec + frac*scale, endian, linktype, mm[pos:pos+caplen]
+            pos += caplen
+
+    def _pcapng_packets(self, mm):
+        endian = '<'
+        interfaces = []
+        timestamp = 0.0
+        pos = 0
+        while pos + 12 <= len(mm):
+            block_type = struct.unpack_from(endian+'I', mm, pos)[0]
+            if block_type == 0x0A0D0D0A:
+                # section header: byte-order magic defines endianness of the section
+                bom = mm[pos+8:pos+12]
+                if bom == b'\x4d\x3c\x2b\x1a':
+                    endian = '<'
+                elif bom == b'\x1a\x2b\x3c\x4d':
+                    endian = '>'
+                else:
+                    raise ValueError(f'{self.path}: invalid pcapng section header at offset {pos}')
+                interfaces = []
+            block_len = struct.unpack_from(endian+'I', mm, pos+4)[0]
+            if block_len < 12 or pos + block_len > len(mm):
+                break
+
+            if block_type == 1:
+                # interface description: linktype and if_tsresol option
+                linktype = struct.unpack_from(endian+'H', mm, pos+8)[0]
+                resolution = 1e-6
+                opt = pos + 16
+                while opt + 4 <= pos + block_len - 4:
+                    code, length = struct.unpack_from(endian+'HH', mm, opt)
+                    if code == 0:
+                        break
+                    if code == 9 and length >= 1:
+                        v = mm[opt+4]
+                        resolution = 2.0**-(v & 0x7F) if v & 0x80 else 10.0**-v
+                    opt += 4 + (length + 3)//4*4
+                interfaces.append((linktype, resolution))
+                self.linktypes.add(linktype)
+            elif block_type == 6 and block_len >= 32:
+                # enhanced packet, skipped if malformed
+                iface, ts_high, ts_low, caplen = struct.unpack_from(endian+'IIII', mm, pos+8)
+                if iface < len(interfaces):
+                    linktype, resolution = interfaces[iface]
+                    timestamp = ((ts_high << 32) | ts_low) * resolution
+                    yield timestamp, endian, linktype, mm[pos+28:pos+28+min(caplen, block_len-32)]
+            elif block_type == 3 and interfaces:
+                # simple packet: no timestamp, keep the last one
+                origlen = struct.unpack_from(endian+'I', mm, pos+8)[0]
+                caplen = min(origlen, block_len - 16)
+                yield timestamp, endian, interfaces[0][0], mm[pos+12:pos+12+caplen]
+
+            pos += block_len
+
+    def Packets(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f'{self.path}: empty file')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                if mm[:4] == self.PCAPNG_MAGIC:
+                    yield from self._pcapng_packets(mm)
+                elif mm[:4] in self.PCAP_MAGIC:
+                    yield from self._pcap_packets(mm)
+                else:
+                    raise ValueError(f'{self.path}: not a pcap/pcapng file')
+
+    def Transfers(self):
+        '''
+            Yield (time, (bus, device, endpoint), data) for bulk/interrupt transfers carrying data:
+            submissions of OUT endpoints and completions of IN endpoints
+        '''
+        headers = {}
+        for timestamp, endian, linktype, packet in self.Packets():
+            if linktype == self.LINKTYPE_USB_LINUX:
+                header_len = 48
+            elif linktype == self.LINKTYPE_USB_LINUX_MMAPPED:
+                header_len = 64
+            else:
+                continue
+            if len(packet) < header_len:
+                continue
+            header = headers.get(endian)
+            if header is None:
+                header = headers[endian] = struct.Struct(endian+self.USBMON_HEADER)
+            _, event, xfer_type, epnum, devnum, busnum, _, _, _, _, _, _, len_cap = header.unpack_from(packet)
+            if xfer_type not in (1, 3) or not len_cap:
+                continue
+            if (event == ord('S') and not epnum & 0x80) or (event == ord('C') and epnum & 0x80):
+                yield timestamp, (busnum, devnum, epnum), packet[header_len:header_len+len_cap]
+
+        if not self.linktypes & {self.LINKTYPE_USB_LINUX, self.LINKTYPE_USB_LINUX_MMAPPED}:
+            raise ValueError(f'{self.path}: no usbmon interface in capture (link types: {sorted(self.linktypes)})')
+
+    @staticmethod
+    def _sysex_chunks(data):
+        '''
+            Yield (cable, bytes, end) for every SysEx event of USB-MIDI event packets
+            (CIN 4 - SysEx start/continue, CIN 5/6/7 - SysEx ends with 1/2/3 bytes)
+        '''
+        for i in range(0, len(data) - 3, 4):
+            cin = data[i] & 0x0F
+            if 0x4 <= cin <= 0x7:
+                yield data[i] >> 4, data[i+1:i+(4 if cin == 0x4 else cin-3)], cin != 0x4
+
+    def Messages(self):
+        '''
+            Yield (time, direction, message) with SysEx messages reassembled from USB-MIDI event packets
+        '''
+        buffers = {}
+        for timestamp, endpoint, data in self.Transfers():
+            direction = 'in' if endpoint[2] & 0x80 else 'out'
+            for cable, chunk, end in self._sysex_chunks(data):
+                key = (endpoint, cable)
+                start = chunk.rfind(0xF0)
+                if start != -1:
+                    buffer = buffers[key] = bytearray(chunk[start:])
+                else:
+                    buffer = buffers.get(key)
+                    if buffer is None:
+                        # not a SysEx (e.g. single byte system common message)
+                        continue
+                    if len(buffer) < self.MAX_SYSEX:
+                        buffer += chunk
+                if end:
+                    del buffers[key]
+                    if buffer[-1] == 0xF7:
+                        yield timestamp, direction, list(buffer)
+
+    def Analyze(self):
+        last_values = {}
+        for timestamp, direction, message in self.Messages():
+            if self.start_time is None:
+                self.start_time = timestamp
+            res = UR44C._sysex_parser(message)
+            self.message_counts[res['type']] = self.message_counts.get(res['type'], 0) + 1
+
+            if res['type'] in ('change-parameter', 'reply-parameter'):
+                key = (res['channel'], res['param'])
+                if last_values.get(key) != res['value']:
+                    last_values[key] = res['value']
+                    self.timelines.setdefault(key, []).append((timestamp, direction, res['value']))
+            elif res['type'] == 'unknown':
+                prefix = bytes(message[:8]).hex().upper()
+                stat = self.unknown.get(prefix)
+                if stat is None:
+                    self.unknown[prefix] = [1, len(message), len(message), timestamp, timestamp]
+                else:
+                    stat[0] += 1
+                    stat[1] = min(stat[1], len(message))
+                    stat[2] = max(stat[2], len(message))
+                    stat[4] = timestamp
+        return self
+
+
 
 def main():
     formatter = lambda prog: argparse.HelpFormatter(prog,max_help_position=45)
@@ -579,6 +1347,7 @@ def main():
     parser.add_argument('--midi-out', '-mo', action='store', help='Output MIDI port', metavar='PORT', default='')
     parser.add_argument('--input', '-i', action='store', type=int, metavar='input', help='Input number (for Inputs, default:1)', default=1)
     parser.add_argument('--unit', '-u', action='store', metavar='UNIT', help='Unit name (default:mixer)', default='mixer')
+    parser.add_argument('--physical', '-p', action='store_true', help='Show values in physical units (dB, Hz, ms) when known')
 
     commands = parser.add_argument_group('Commands')
     command = commands.add_mutually_exclusive_group(required=True)
@@ -586,41 +1355,28 @@ def main():
     command.add_argument('--list-units', '-lu', action='store_true', help='List unit names')
     command.add_argument('--list-parameters', '-l', action='store_true', help='List available parameters in unit')
     command.add_argument('--get-parameter', '-g', action='store', metavar='PARAMETER', help='Get parameter value')
-    command.add_argument('--set-parameter', '-s', action='store', metavar=('PARAMETER', '(VALUE|min|max|def)'), nargs=2, help='Set parameter value')
+    command.add_argument('--set-parameter', '-s', action='store', metavar=('PARAMETER', '(VALUE|min|max|def)'), nargs=2, help='Set parameter value: bare integers are raw values, physical values need a unit (e.g. 1kHz, 250ms, -6dB, -inf; negative values with unit can be passed as is: -s MainMix1Volume -6dB)')
+    command.add_argument('--dump', '-d', action='store_true', help='Show values of all parameters in unit')
     command.add_argument('--reset', action='store_true', help='Reset mixer config')
+    command.add_argument('--record-meters', action='store', metavar='FILE', help='Record meter history into file until interrupted')
+    command.add_argument('--analyze-capture', action='store', metavar='FILE', help='Analyze usbmon capture (pcap/pcapng)')
 
     command.add_argument('--test', action='store_true', help=argparse.SUPPRESS)
 
-    args = parser.parse_args()
-
-    if args.unit=='mixer':
-        unit = UR44C_Params_Mixer
-    elif args.unit=='chstrip':
-        unit = UR44C_Params_ChStrip
-    elif args.unit=='clean':
-        unit = UR44C_Params_Clean
-    elif args.unit=='crunch':
-        unit = UR44C_Params_Crunch
-    elif args.unit=='lead':
-        unit = UR44C_Params_Lead
-    elif args.unit=='drive':
-        unit = UR44C_Params_Drive
-    elif args.unit=='pitchfix':
-        unit = UR44C_Params_PitchFix
-    elif args.unit=='hall':
-        unit = UR44C_Params_Hall
-    elif args.unit=='room':
-        unit = UR44C_Params_Room
-    elif args.unit=='plate':
-        unit = UR44C_Params_Plate
-    elif args.unit=='delay':
-        unit = UR44C_Params_Delay
-    elif args.unit=='ducker':
-        unit = UR44C_Params_Ducker
-    elif args.unit=='mbcomp':
-        unit = UR44C_Params_MBComp
-    else:
+    # argparse takes values like -6dB or -inf as options: mark them as values by a leading space
+    # (int() and UR44C_ParameterUnits.Parse ignore it). Plain negative numbers are handled by argparse.
+    argv = sys.argv[1:]
+    for i in range(len(argv)-2):
+        if argv[i] in ('--set-parameter', '-s') and argv[i+2].startswith('-'):
+            try:
+                int(argv[i+2])
+            except ValueError:
+                argv[i+2] = ' ' + argv[i+2]
+    args = parser.parse_args(argv)
+
+    if args.unit not in units:
         raise Exception('Unit does not exists')
+    unit = units[args.unit]
 
     if args.get_midi_ports:
         print('Input:')
@@ -630,19 +1386,8 @@ def main():
         for port in rtmidi.MidiOut().get_ports():
             print(f'  {port}')
     elif args.list_units:
-        print('mixer')
-        print('chstrip')
-        print('clean')
-        print('crunch')
-        print('lead')
-        print('drive')
-        print('pitchfix')
-        print('hall')
-        print('room')
-        print('plate')
-        print('delay')
-        print('ducker')
-        print('mbcomp')
+        for name in units:
+            print(name)
     elif args.list_parameters:
         if args.verbose:
             print('NAME                 MIN.VAL MAX.VAL DEF.VAL   VALUE EXPLAIN                      NOTES')
@@ -659,19 +1404,37 @@ def main():
         midi_in, midi_out = open_midi_ports(args)
         ur44c = UR44C(midi_in, midi_out)
         value = ur44c.GetParameterByName(unit, args.get_parameter, args.input-1)
+        param_units = get_parameter_units(getattr(unit, args.get_parameter))
         if args.verbose:
             attr = getattr(unit, args.get_parameter)
             print(f'{args.get_parameter}  |  {attr[4]}')
             print()
-            print(f'CURRENT VALUE: {value}')
+            if param_units and value is not None:
+                print(f'CURRENT VALUE: {value} ({param_units.Format(value)})')
+            else:
+                print(f'CURRENT VALUE: {value}')
             print(f'Minimal: {attr[1]}')
             print(f'Maximum: {attr[2]}')
             print(f'Default: {attr[3]}')
             if attr[5]:
                 print(f'Notes: {attr[5]}')
+        elif args.physical and param_units and value is not None:
+            print(param_units.Format(value))
         else:
             print(value)
 
+    elif args.dump:
+        midi_in, midi_out = open_midi_ports(args)
+        ur44c = UR44C(midi_in, midi_out)
+        for name in vars(unit):
+            if not name.startswith('__'):
+                value = ur44c.GetParameterByName(unit, name, args.input-1)
+                param_units = get_parameter_units(getattr(unit, name))
+                if args.physical and param_units and value is not None:
+                    print(f'{name:<20} {value:>7}   {param_units.Format(value)}')
+                else:
+                    print(f'{name:<20} {value if value is not None else "":>7}')
+
     elif args.set_parameter:
         midi_in, midi_out = open_midi_ports(args)
         ur44c = UR44C(midi_in, midi_out)
@@ -682,7 +1445,20 @@ def main():
         elif args.set_parameter[1]=='def':
             value = getattr(unit, args.set_parameter[0])[3]
         else:
-            value = int(args.set_parameter[1])
+            try:
+                value = int(args.set_parameter[1])
+            except ValueError:
+                param_units = get_parameter_units(getattr(unit, args.set_parameter[0]))
+                if param_units is None:
+                    print(f'Parameter {args.set_parameter[0]} has no physical units, value must be an integer')
+                    sys.exit(1)
+                try:
+                    value = param_units.Parse(args.set_parameter[1])
+                except ValueError as e:
+                    print(e)
+                    sys.exit(1)
+                if args.verbose:
+                    print(f'{args.set_parameter[1]} -> {value} ({param_units.Format(value)})')
         result = ur44c.SetParameterByName(unit, args.set_parameter[0], value, args.input-1)    
         if not result:
             print('FAILED')
@@ -694,6 +1470,55 @@ def main():
         ur44c = UR44C(midi_in, midi_out)
         ur44c.ResetConfig()
 
+    elif args.record_meters:
+        midi_in, midi_out = open_midi_ports(args)
+        ur44c = UR44C(midi_in, midi_out)
+        history = UR44C_MeterHistory(args.record_meters)
+        ur44c.meter_history = history
+        watcher = UR44C_PortWatcher(ur44c, args.midi_in, args.midi_out, verbose=args.verbose)
+        watcher.Start()
+        try:
+            while True:
+                if ur44c.connected.wait(1):
+                    ur44c.SendKeepalive()
+                    ur44c.MIDISendQueryMeters()
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.Stop()
+            ur44c.meter_history = None
+            history.Close()
+        if args.verbose:
+            print(f'Recorded {history.levels[0].count} meter frames')
+
+    elif args.analyze_capture:
+        try:
+            analyzer = UR44C_CaptureAnalyzer(args.analyze_capture).Analyze()
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+        param_names = {}
+        for unit_name, unit_class in units.items():
+            for name in vars(unit_class):
+                if not name.startswith('__'):
+                    param_names.setdefault(getattr(unit_class, name)[0], []).append(f'{unit_name}.{name}')
+
+        print('Messages:')
+        for message_type, count in sorted(analyzer.message_counts.items()):
+            print(f'  {message_type:<20} {count:>10}')
+        print()
+        print('Parameter timelines:')
+        for (channel, param), timeline in sorted(analyzer.timelines.items()):
+            print(f'  param {param} ch{channel+1} ({", ".join(param_names.get(param, ["?"]))})')
+            for timestamp, direction, value in timeline:
+                print(f'    {timestamp-analyzer.start_time:12.6f} {direction:<3} {value}')
+        print()
+        print('Unknown messages:')
+        print('  PREFIX                 COUNT  MIN.LEN  MAX.LEN      FIRST       LAST')
+        for prefix, (count, min_len, max_len, first, last) in sorted(analyzer.unknown.items()):
+            print(f'  {prefix:<16} {count:>11} {min_len:>8} {max_len:>8} {first-analyzer.start_time:>10.3f} {last-analyzer.start_time:>10.3f}')
+
     elif args.test:
         midi_in, midi_out = open_midi_ports(args)
         ur44c = UR44C(midi_in, midi_out)